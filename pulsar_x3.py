@@ -14,7 +14,6 @@ Usage:
     python3 pulsar_x3.py --debounce 3
 """
 
-import usb.core
 import struct
 import sys
 import argparse
@@ -27,26 +26,132 @@ VID = 0x3710
 PID_WIRED = 0x3410
 PID_WIRELESS = 0x5403
 
-def calculate_checksum(data):
-    """Calculate 16-bit checksum"""
-    return sum(data[:-2]) & 0xFFFF
+# How long the mouse got to answer before its report was read; a response
+# that can't be told apart from the previous one is only trusted after it
+SETTLE_TIME = 0.05
 
-def send_command(dev, command_bytes, retries=3):
-    """Send command and return response with retry logic"""
-    for attempt in range(retries):
-        try:
-            packet = bytearray(64)
-            packet[0] = 0x00  # Report ID
-            for i, byte in enumerate(command_bytes):
-                packet[i+1] = byte
+# PyUSB is imported on first use so --help and usage errors don't wait on it
+usb = None
+
+def _import_usb():
+    global usb
+    if usb is None:
+        import usb.core
+
+# Display strings for every possible response byte, built once at import
+# LOD is stored as mm * 10 (7=0.7mm, 10=1mm, 20=2mm)
+LOD_STR = tuple(f"{value / 10:g}mm" for value in range(256))
+DEBOUNCE_STR = tuple(f"{value}ms" for value in range(256))
+
+def calculate_checksum(data, length=62):
+    """Calculate 16-bit checksum
+
+    Only the first `length` bytes are summed; callers that know the rest of
+    the packet is still zero can pass a shorter length to skip it.
+    """
+    # A plain slice sum measured faster than summing a memoryview or folding
+    # the bytes as one big int, and the reports are too small for NumPy/Numba
+    return sum(data[:length]) & 0xFFFF
+
+def verify_checksum(data):
+    """Check the 16-bit checksum stored in bytes 62-63 of a packet"""
+    return calculate_checksum(data) == struct.unpack_from('<H', data, 62)[0]
+
+def _build_packet(*command_bytes):
+    """Build a complete report, checksum included, for a fixed command"""
+    packet = bytearray(64)
+    packet[1:1+len(command_bytes)] = bytes(command_bytes)
+    struct.pack_into('<H', packet, 62, calculate_checksum(packet, 1+len(command_bytes)))
+    return bytes(packet)
+
+# Query commands never change, so their reports are built once at import
+_QUERY_PACKETS = {
+    'version': _build_packet(0x01, 0x87, 0x04),
+    'dpi': _build_packet(0x05, 0x82, 0x05),
+    'stage': _build_packet(0x05, 0x81, 0x02),
+    'motion_sync': _build_packet(0x07, 0x85, 0x02),
+    'lod': _build_packet(0x07, 0x82, 0x03),
+    'angle_snap': _build_packet(0x07, 0x84, 0x02),
+    'ripple_control': _build_packet(0x07, 0x83, 0x02),
+    'debounce': _build_packet(0x04, 0x83, 0x03),
+    'battery': _build_packet(0x08, 0x81, 0x01),
+    'polling_rate': _build_packet(0x08, 0x85, 0x03),
+}
+
+# Write commands, as captured: report header and the struct format of the
+# value written after it
+_SETTERS = {
+    'dpi': ((0x00, 0x05, 0x02, 0x05, 0x00, 0x00, 0x01), '<HH'),  # DPI X, DPI Y
+    'stage': ((0x00, 0x05, 0x01, 0x02, 0x00, 0x00, 0x01), 'B'),
+    'motion_sync': ((0x00, 0x07, 0x05, 0x02, 0x00, 0x00, 0x01), 'B'),
+    'lod': ((0x00, 0x07, 0x02, 0x03, 0x00, 0x00, 0x01, 0x02), 'B'),  # mm * 10
+    'angle_snap': ((0x00, 0x07, 0x04, 0x02, 0x00, 0x00, 0x01), 'B'),
+    'ripple_control': ((0x00, 0x07, 0x03, 0x02, 0x00, 0x00, 0x01), 'B'),
+    'debounce': ((0x00, 0x04, 0x03, 0x03, 0x00, 0x00, 0x01), 'B'),  # ms
+}
+
+def _setter_template(header, fmt):
+    """Expand a _SETTERS entry to (zeroed report, value format, value offset, used length)"""
+    packet = bytearray(64)
+    packet[:len(header)] = header
+    return bytes(packet), fmt, len(header), len(header) + struct.calcsize(fmt)
 
-            checksum = calculate_checksum(packet)
-            struct.pack_into('<H', packet, 62, checksum)
+_SETTER_TEMPLATES = {key: _setter_template(*entry) for key, entry in _SETTERS.items()}
 
-            dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
-            time.sleep(0.05)
+# Reused for every outgoing setter report instead of allocating one per command
+_packet = bytearray(64)
+
+def _send_setter(dev, key, *values):
+    """Write a setting described by its _SETTERS entry"""
+    template, fmt, offset, length = _SETTER_TEMPLATES[key]
+    _packet[:] = template
+    struct.pack_into(fmt, _packet, offset, *values)
+    struct.pack_into('<H', _packet, 62, calculate_checksum(_packet, length))
+    dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, _packet, timeout=1000)
+
+def send_command_async(dev, packet):
+    """Send a prepared report without waiting for the response"""
+    dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, packet, timeout=1000)
+
+def read_report(dev):
+    """Return the report the mouse currently holds, or None if it can't be read"""
+    _import_usb()
+    try:
+        return dev.ctrl_transfer(0xA1, 0x01, 0x0300, 3, 64, timeout=50)
+    except usb.core.USBError:
+        return None
+
+def recv_response(dev, packet, previous=None):
+    """Read the response to packet, returning early once the device has answered it
+
+    GET_REPORT returns whatever the mouse last answered. A read that differs
+    from previous (the report held before packet was sent) and carries
+    packet's command bytes (1-3) is returned at once. Anything else, such as
+    a repeat of the last query, is read after the full settle time as before.
+    """
+    _import_usb()
+    deadline = time.monotonic() + SETTLE_TIME
+    while time.monotonic() < deadline:
+        try:
+            response = dev.ctrl_transfer(0xA1, 0x01, 0x0300, 3, 64, timeout=50)
+            if response != previous and bytes(response[1:4]) == packet[1:4]:
+                return response
+        except usb.core.USBError:
+            pass
+        time.sleep(0.002)
+    return dev.ctrl_transfer(0xA1, 0x01, 0x0300, 3, 64, timeout=1000)
 
-            response = dev.ctrl_transfer(0xA1, 0x01, 0x0300, 3, 64, timeout=1000)
+def send_command(dev, packet, retries=3):
+    """Send command and return response with retry logic"""
+    _import_usb()
+    for attempt in range(retries):
+        try:
+            previous = read_report(dev)
+            send_command_async(dev, packet)
+            response = recv_response(dev, packet, previous)
+            if not verify_checksum(response):
+                print(f"WARNING: Response checksum mismatch for command {packet[1:4].hex(' ')}",
+                      file=sys.stderr)
             return response
         except usb.core.USBError as e:
             if attempt < retries - 1:
@@ -58,14 +163,7 @@ def set_dpi(dev, dpi):
     """Set mouse DPI"""
     print(f"Setting DPI to {dpi}...")
 
-    packet = bytearray(64)
-    packet[0:7] = [0x00, 0x05, 0x02, 0x05, 0x00, 0x00, 0x01]
-    struct.pack_into('<H', packet, 7, dpi)
-    struct.pack_into('<H', packet, 9, dpi)
-    checksum = calculate_checksum(packet)
-    struct.pack_into('<H', packet, 62, checksum)
-
-    dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
+    _send_setter(dev, 'dpi', dpi, dpi)
     print(f"✓ DPI set to {dpi}")
     print("Move your mouse to feel the difference!")
 
@@ -77,84 +175,78 @@ def set_stage(dev, stage):
 
     print(f"Switching to DPI stage {stage}...")
 
-    # Command: 05 01 02 00 00 01 XX (from capture)
-    packet = bytearray(64)
-    packet[0:8] = [0x00, 0x05, 0x01, 0x02, 0x00, 0x00, 0x01, stage]
-    checksum = calculate_checksum(packet)
-    struct.pack_into('<H', packet, 62, checksum)
-
-    dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
+    _send_setter(dev, 'stage', stage)
     print(f"✓ Switched to DPI stage {stage}")
     return True
 
 
 def query_version(dev):
     """Query mouse firmware version"""
-    response = send_command(dev, [0x01, 0x87, 0x04])
+    response = send_command(dev, _QUERY_PACKETS['version'])
     # Bytes 6-7 contain version, displayed as hex
-    minor = response[6]
-    major = response[7]
+    minor, major = struct.unpack_from('BB', response, 6)
     return f"00.00.{major:02x}.{minor:02x}"
 
 def query_info(dev):
     """Query mouse information"""
-    print("="*70)
-    print("Pulsar X3 Mouse Information")
-    print("="*70)
+    # Collected and written once at the end rather than printed line by line
+    lines = ["="*70, "Pulsar X3 Mouse Information", "="*70]
 
     # Dongle version from USB descriptor
     dongle_version = f"{dev.bcdDevice:04x}"
-    print(f"\nDongle Firmware: {dongle_version}")
+    lines.append(f"\nDongle Firmware: {dongle_version}")
 
     # Mouse version from query
     mouse_version = query_version(dev)
-    print(f"Mouse Firmware: {mouse_version}")
+    lines.append(f"Mouse Firmware: {mouse_version}")
 
     # Query DPI and stage
     dpi_x, dpi_y, stage = query_dpi(dev)
     if dpi_x == dpi_y:
-        print(f"\nDPI: {dpi_x} (stage {stage})")
+        lines.append(f"\nDPI: {dpi_x} (stage {stage})")
     else:
-        print(f"\nDPI: {dpi_x} x {dpi_y} (stage {stage})")
+        lines.append(f"\nDPI: {dpi_x} x {dpi_y} (stage {stage})")
 
     # Motion Sync
     motion_status, _ = query_motion_sync(dev)
-    print(f"Motion Sync: {motion_status}")
+    lines.append(f"Motion Sync: {motion_status}")
 
     # LOD
     lod_str, _ = query_lod(dev)
-    print(f"Lift-off Distance: {lod_str}")
+    lines.append(f"Lift-off Distance: {lod_str}")
 
     # Angle snapping
     angle_status, _ = query_angle_snap(dev)
-    print(f"Angle Snapping: {angle_status}")
+    lines.append(f"Angle Snapping: {angle_status}")
 
     # Ripple Control
     ripple_status, _ = query_ripple_control(dev)
-    print(f"Ripple Control: {ripple_status}")
+    lines.append(f"Ripple Control: {ripple_status}")
 
     # Debounce
     debounce = query_debounce(dev)
-    print(f"Debounce: {debounce}ms")
+    lines.append(f"Debounce: {DEBOUNCE_STR[debounce]}")
 
     # Battery
-    response = send_command(dev, [0x08, 0x81, 0x01])
+    response = send_command(dev, _QUERY_PACKETS['battery'])
     battery = response[6]
-    print(f"Battery: {battery}%")
+    lines.append(f"Battery: {battery}%")
 
     # Polling rate query (unreliable - may not reflect actual rate)
     poll_rate, poll_value = query_polling_rate(dev)
     if poll_rate:
-        print(f"Polling Rate: {poll_rate}Hz (unreliable)")
+        lines.append(f"Polling Rate: {poll_rate}Hz (unreliable)")
     else:
-        print(f"Polling Rate: Unknown ({poll_value})")
+        lines.append(f"Polling Rate: Unknown ({poll_value})")
 
-    print("="*70)
+    lines.append("="*70)
+
+    sys.stdout.write("\n".join(lines) + "\n")
 
 def query_battery(dev):
     """Query battery percentage"""
     # Battery is in response to command 08 81 01, byte 6
-    response = send_command(dev, [0x08, 0x81, 0x01])
+    response = send_command(dev, _QUERY_PACKETS['battery'])
     battery_percent = response[6]
 
     print(f"\n🔋 Battery: {battery_percent}%")
@@ -165,30 +257,21 @@ def set_motion_sync(dev, enable):
     state = "ON" if enable else "OFF"
     print(f"Setting Motion Sync {state}...")
 
-    # Command: 07 05 02 00 00 01 XX (from capture)
-    packet = bytearray(64)
-    packet[0:8] = [0x00, 0x07, 0x05, 0x02, 0x00, 0x00, 0x01, value]
-    checksum = calculate_checksum(packet)
-    struct.pack_into('<H', packet, 62, checksum)
-
-    dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
+    _send_setter(dev, 'motion_sync', value)
     print(f"✓ Motion Sync {state}")
 
 def query_motion_sync(dev):
     """Query motion sync status"""
-    response = send_command(dev, [0x07, 0x85, 0x02])
+    response = send_command(dev, _QUERY_PACKETS['motion_sync'])
     value = response[7]
     status = "ON" if value == 1 else "OFF"
     return status, value
 
 def query_lod(dev):
     """Query LOD (lift-off distance)"""
-    response = send_command(dev, [0x07, 0x82, 0x03])
+    response = send_command(dev, _QUERY_PACKETS['lod'])
     value = response[8]
-    # LOD is stored as mm * 10 (7=0.7mm, 10=1mm, 20=2mm)
-    lod_map = {7: "0.7mm", 10: "1mm", 20: "2mm"}
-    lod_str = lod_map.get(value, f"{value/10}mm")
-    return lod_str, value
+    return LOD_STR[value], value
 
 def set_lod(dev, lod_mm):
     """Set LOD (lift-off distance). Options: 0.7, 1, 2 (in mm)"""
@@ -202,26 +285,20 @@ def set_lod(dev, lod_mm):
 
     print(f"Setting LOD to {valid_values[lod_value]}...")
 
-    # Command: 07 02 03 00 00 01 02 XX (from capture, XX = mm*10)
-    packet = bytearray(64)
-    packet[0:9] = [0x00, 0x07, 0x02, 0x03, 0x00, 0x00, 0x01, 0x02, lod_value]
-    checksum = calculate_checksum(packet)
-    struct.pack_into('<H', packet, 62, checksum)
-
-    dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
+    _send_setter(dev, 'lod', lod_value)
     print(f"✓ LOD set to {valid_values[lod_value]}")
     return True
 
 def query_angle_snap(dev):
     """Query angle snapping status"""
-    response = send_command(dev, [0x07, 0x84, 0x02])
+    response = send_command(dev, _QUERY_PACKETS['angle_snap'])
     value = response[7]
     status = "ON" if value == 1 else "OFF"
     return status, value
 
 def query_ripple_control(dev):
     """Query ripple control status"""
-    response = send_command(dev, [0x07, 0x83, 0x02])
+    response = send_command(dev, _QUERY_PACKETS['ripple_control'])
     value = response[7]
     status = "ON" if value == 1 else "OFF"
     return status, value
@@ -232,18 +309,12 @@ def set_ripple_control(dev, enable):
     state = "ON" if enable else "OFF"
     print(f"Setting Ripple Control {state}...")
 
-    # Command: 07 03 02 00 00 01 XX (from capture)
-    packet = bytearray(64)
-    packet[0:8] = [0x00, 0x07, 0x03, 0x02, 0x00, 0x00, 0x01, value]
-    checksum = calculate_checksum(packet)
-    struct.pack_into('<H', packet, 62, checksum)
-
-    dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
+    _send_setter(dev, 'ripple_control', value)
     print(f"✓ Ripple Control {state}")
 
 def query_debounce(dev):
     """Query debounce time in ms"""
-    response = send_command(dev, [0x04, 0x83, 0x03])
+    response = send_command(dev, _QUERY_PACKETS['debounce'])
     value = response[7]
     return value
 
@@ -251,24 +322,17 @@ def set_debounce(dev, ms):
     """Set debounce time in ms"""
     print(f"Setting Debounce to {ms}ms...")
 
-    # Command: 04 03 03 00 00 01 XX (from capture)
-    packet = bytearray(64)
-    packet[0:8] = [0x00, 0x04, 0x03, 0x03, 0x00, 0x00, 0x01, ms]
-    checksum = calculate_checksum(packet)
-    struct.pack_into('<H', packet, 62, checksum)
-
-    dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
+    _send_setter(dev, 'debounce', ms)
     print(f"✓ Debounce set to {ms}ms")
 
 def query_dpi(dev):
     """Query current DPI and stage"""
     # Query DPI values
-    response = send_command(dev, [0x05, 0x82, 0x05])
-    dpi_x = response[7] | (response[8] << 8)
-    dpi_y = response[9] | (response[10] << 8)
+    response = send_command(dev, _QUERY_PACKETS['dpi'])
+    dpi_x, dpi_y = struct.unpack_from('<HH', response, 7)
 
     # Query current stage
-    response = send_command(dev, [0x05, 0x81, 0x02])
+    response = send_command(dev, _QUERY_PACKETS['stage'])
     stage = response[7]
 
     return dpi_x, dpi_y, stage
@@ -279,13 +343,7 @@ def set_angle_snap(dev, enable):
     state = "ON" if enable else "OFF"
     print(f"Setting Angle Snapping {state}...")
 
-    # Command: 07 04 02 00 00 01 XX (from capture)
-    packet = bytearray(64)
-    packet[0:8] = [0x00, 0x07, 0x04, 0x02, 0x00, 0x00, 0x01, value]
-    checksum = calculate_checksum(packet)
-    struct.pack_into('<H', packet, 62, checksum)
-
-    dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
+    _send_setter(dev, 'angle_snap', value)
     print(f"✓ Angle Snapping {state}")
 
 # Polling rate query value mapping (unreliable - doesn't reflect actual rate)
@@ -301,7 +359,7 @@ POLLING_QUERY_TO_RATE = {
 
 def query_polling_rate(dev):
     """Query current polling rate (unreliable)"""
-    response = send_command(dev, [0x08, 0x85, 0x03])
+    response = send_command(dev, _QUERY_PACKETS['polling_rate'])
     value = response[7]
     rate = POLLING_QUERY_TO_RATE.get(value, None)
     return rate, value
@@ -326,6 +384,8 @@ def main():
         parser.print_help()
         return 0
 
+    _import_usb()
+
     # Acquire file lock to prevent concurrent access
     lock_fd = open(LOCK_FILE, 'w')
     try:
@@ -8,7 +8,7 @@ gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 from gi.repository import Gtk, Adw, GLib, Gio
 
-import usb.core
+import functools
 import struct
 import time
 import threading
@@ -17,6 +17,82 @@ VID = 0x3710
 PID_WIRED = 0x3410
 PID_WIRELESS = 0x5403
 
+# How long the mouse got to answer before its report was read; a response
+# that can't be told apart from the previous one is only trusted after it
+SETTLE_TIME = 0.05
+
+# PyUSB is imported by the first connect() so the window can show without it
+usb = None
+
+
+def _import_usb():
+    global usb
+    if usb is None:
+        import usb.core
+        import usb.util
+
+
+def calculate_checksum(data, length=62):
+    """Calculate 16-bit checksum over the first `length` bytes"""
+    # A plain slice sum measured faster than summing a memoryview or folding
+    # the bytes as one big int, and the reports are too small for NumPy/Numba
+    return sum(data[:length]) & 0xFFFF
+
+
+def verify_checksum(data):
+    """Check the 16-bit checksum stored in bytes 62-63 of a packet"""
+    return calculate_checksum(data) == struct.unpack_from('<H', data, 62)[0]
+
+
+def _build_packet(*command_bytes):
+    """Build a complete report, checksum included, for a fixed command"""
+    packet = bytearray(64)
+    packet[1:1+len(command_bytes)] = bytes(command_bytes)
+    checksum = calculate_checksum(packet, 1+len(command_bytes))
+    struct.pack_into('<H', packet, 62, checksum)
+    return bytes(packet)
+
+
+# Query commands never change, so their reports are built once at import
+_QUERY_PACKETS = {
+    'version': _build_packet(0x01, 0x87, 0x04),
+    'dpi': _build_packet(0x05, 0x82, 0x05),
+    'stage': _build_packet(0x05, 0x81, 0x02),
+    'motion_sync': _build_packet(0x07, 0x85, 0x02),
+    'lod': _build_packet(0x07, 0x82, 0x03),
+    'angle_snap': _build_packet(0x07, 0x84, 0x02),
+    'ripple_control': _build_packet(0x07, 0x83, 0x02),
+    'debounce': _build_packet(0x04, 0x83, 0x03),
+    'battery': _build_packet(0x08, 0x81, 0x01),
+}
+
+# Write commands, as captured: report header and the struct format of the
+# value written after it
+_SETTERS = {
+    'dpi': ((0x00, 0x05, 0x02, 0x05, 0x00, 0x00, 0x01), '<HH'),  # DPI X, DPI Y
+    'stage': ((0x00, 0x05, 0x01, 0x02, 0x00, 0x00, 0x01), 'B'),
+    'motion_sync': ((0x00, 0x07, 0x05, 0x02, 0x00, 0x00, 0x01), 'B'),
+    'lod': ((0x00, 0x07, 0x02, 0x03, 0x00, 0x00, 0x01, 0x02), 'B'),  # mm * 10
+    'angle_snap': ((0x00, 0x07, 0x04, 0x02, 0x00, 0x00, 0x01), 'B'),
+    'ripple_control': ((0x00, 0x07, 0x03, 0x02, 0x00, 0x00, 0x01), 'B'),
+    'debounce': ((0x00, 0x04, 0x03, 0x03, 0x00, 0x00, 0x01), 'B'),  # ms
+}
+
+
+def _setter_template(header, fmt):
+    """Expand a _SETTERS entry to (zeroed report, value format, value offset, used length)"""
+    packet = bytearray(64)
+    packet[:len(header)] = header
+    return bytes(packet), fmt, len(header), len(header) + struct.calcsize(fmt)
+
+
+_SETTER_TEMPLATES = {key: _setter_template(*entry) for key, entry in _SETTERS.items()}
+
+# Everything get_info reads, in the order it parses the responses
+_INFO_PACKETS = tuple(_QUERY_PACKETS[name] for name in (
+    'version', 'dpi', 'stage', 'motion_sync', 'lod',
+    'angle_snap', 'ripple_control', 'debounce', 'battery'))
+
 
 class PulsarDevice:
     """Handle communication with the Pulsar X3 mouse"""
@@ -24,9 +100,50 @@ class PulsarDevice:
     def __init__(self):
         self.dev = None
         self.mode = None
+        # Reused for every outgoing report instead of allocating one per command
+        self._pkt = bytearray(64)
+        # Responses are read into these instead of a fresh array per transfer
+        self._rx = []
+        self._write = None
+        self._read = None
+        # Shared by every user of the connection; the kernel driver is only
+        # detached by the first connect() and reattached by the last disconnect()
+        self._lock = threading.Lock()
+        self._refcount = 0
+        # Set to make a query_all in progress stop before its next query
+        self.cancel = threading.Event()
+
+    @property
+    def connected(self):
+        """True while at least one connect() has not been released"""
+        return self._refcount > 0
 
     def connect(self):
-        """Find and connect to the mouse"""
+        """Find and connect to the mouse, or reuse the open connection"""
+        with self._lock:
+            if self._refcount == 0 and not self._open():
+                return False
+            self._refcount += 1
+            return True
+
+    def disconnect(self):
+        """Release a connection, reattaching the kernel driver after the last one"""
+        with self._lock:
+            if self._refcount == 0:
+                return
+            self._refcount -= 1
+            if self._refcount == 0 and self.dev:
+                try:
+                    self.dev.attach_kernel_driver(3)
+                except:
+                    pass
+
+    def _open(self):
+        """Find the mouse and detach the kernel driver from its HID interface"""
+        _import_usb()
+        if not self._rx:
+            self._rx = [usb.util.create_buffer(64) for _ in _INFO_PACKETS]
+
         self.dev = usb.core.find(idVendor=VID, idProduct=PID_WIRELESS)
         self.mode = "wireless"
 
@@ -40,139 +157,137 @@ class PulsarDevice:
         if self.dev.is_kernel_driver_active(3):
             self.dev.detach_kernel_driver(3)
 
+        # HID SET_REPORT / GET_REPORT (feature report, interface 3) bound once
+        self._write = functools.partial(self.dev.ctrl_transfer, 0x21, 0x09, 0x0300, 3, timeout=1000)
+        self._read = functools.partial(self.dev.ctrl_transfer, 0xA1, 0x01, 0x0300, 3, timeout=50)
+
         return True
 
-    def disconnect(self):
-        """Reattach kernel driver"""
-        if self.dev:
+    def _send_setter(self, key, *values):
+        """Write a setting described by its _SETTERS entry"""
+        template, fmt, offset, length = _SETTER_TEMPLATES[key]
+        self._pkt[:] = template
+        struct.pack_into(fmt, self._pkt, offset, *values)
+        struct.pack_into('<H', self._pkt, 62, calculate_checksum(self._pkt, length))
+        self._write(self._pkt)
+
+    def send_command_async(self, packet):
+        """Send a prepared report without waiting for the response"""
+        self._write(packet)
+
+    def read_report(self, buf):
+        """Read the report the mouse currently holds, as bytes, or None if it can't be read"""
+        try:
+            if self._read(buf) == len(buf):
+                return bytes(buf)
+        except usb.core.USBError:
+            pass
+        return None
+
+    def recv_response(self, packet, buf, previous=None):
+        """Read the response to packet into buf, returning early once the device has answered it
+
+        GET_REPORT returns whatever the mouse last answered. A read that differs
+        from previous (the report held before packet was sent) and carries
+        packet's command bytes (1-3) is returned at once. Anything else, such as
+        a repeat of the last query, is read after the full settle time as before.
+        The returned buffer is reused by later reads, so parse or copy it first.
+        """
+        deadline = time.monotonic() + SETTLE_TIME
+        while time.monotonic() < deadline:
             try:
-                self.dev.attach_kernel_driver(3)
-            except:
+                # A short read would leave the previous refresh's bytes in buf
+                if (self._read(buf) == len(buf) and bytes(buf) != previous
+                        and bytes(buf[1:4]) == packet[1:4]):
+                    return buf
+            except usb.core.USBError:
                 pass
-
-    def send_command(self, command_bytes):
-        """Send command and return response"""
-        packet = bytearray(64)
-        packet[0] = 0x00
-        for i, byte in enumerate(command_bytes):
-            packet[i+1] = byte
-
-        checksum = sum(packet[:-2]) & 0xFFFF
-        struct.pack_into('<H', packet, 62, checksum)
-
-        self.dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
-        time.sleep(0.05)
-
-        response = self.dev.ctrl_transfer(0xA1, 0x01, 0x0300, 3, 64, timeout=1000)
-        return response
+            time.sleep(0.002)
+        if self.dev.ctrl_transfer(0xA1, 0x01, 0x0300, 3, buf, timeout=1000) != len(buf):
+            raise usb.core.USBError(f"Short response to command {packet[1:4].hex(' ')}")
+        return buf
+
+    def query_all(self, packets):
+        """Run several prepared queries in turn and return their responses
+
+        Each OUT report is followed by its own IN read: the mouse holds only
+        one pending answer, so requests cannot be pipelined ahead of reads.
+        """
+        while len(self._rx) < len(packets):
+            self._rx.append(usb.util.create_buffer(64))
+
+        # Only the first query needs the held report read back; each later
+        # one follows the answer that was just read
+        previous = self.read_report(self._rx[0])
+        responses = []
+        for packet, buf in zip(packets, self._rx):
+            if self.cancel.is_set():
+                raise usb.core.USBError("Query cancelled")
+            self.send_command_async(packet)
+            responses.append(self.recv_response(packet, buf, previous))
+            previous = bytes(buf)
+        return responses
 
     def get_info(self):
         """Get all mouse info"""
+        responses = self.query_all(_INFO_PACKETS)
+        (version, dpi, stage, motion_sync, lod, angle_snap,
+         ripple_control, debounce, battery) = responses
+
         info = {}
+        info['checksum_ok'] = all(verify_checksum(response) for response in responses)
 
         # Dongle firmware
         info['dongle_fw'] = f"{self.dev.bcdDevice:04x}"
 
         # Mouse firmware
-        response = self.send_command([0x01, 0x87, 0x04])
-        info['mouse_fw'] = f"00.00.{response[7]:02x}.{response[6]:02x}"
+        minor, major = struct.unpack_from('BB', version, 6)
+        info['mouse_fw'] = f"00.00.{major:02x}.{minor:02x}"
 
         # DPI and stage
-        response = self.send_command([0x05, 0x82, 0x05])
-        info['dpi'] = response[7] | (response[8] << 8)
+        info['dpi'] = struct.unpack_from('<H', dpi, 7)[0]
+        info['stage'] = stage[7]
 
-        response = self.send_command([0x05, 0x81, 0x02])
-        info['stage'] = response[7]
-
-        # Motion sync
-        response = self.send_command([0x07, 0x85, 0x02])
-        info['motion_sync'] = response[7] == 1
+        info['motion_sync'] = motion_sync[7] == 1
 
         # LOD
-        response = self.send_command([0x07, 0x82, 0x03])
-        lod_value = response[8]
         lod_map = {7: 0.7, 10: 1.0, 20: 2.0}
-        info['lod'] = lod_map.get(lod_value, 1.0)
-
-        # Angle snap
-        response = self.send_command([0x07, 0x84, 0x02])
-        info['angle_snap'] = response[7] == 1
-
-        # Ripple control
-        response = self.send_command([0x07, 0x83, 0x02])
-        info['ripple_control'] = response[7] == 1
-
-        # Debounce
-        response = self.send_command([0x04, 0x83, 0x03])
-        info['debounce'] = response[7]
+        info['lod'] = lod_map.get(lod[8], 1.0)
 
-        # Battery
-        response = self.send_command([0x08, 0x81, 0x01])
-        info['battery'] = response[6]
+        info['angle_snap'] = angle_snap[7] == 1
+        info['ripple_control'] = ripple_control[7] == 1
+        info['debounce'] = debounce[7]
+        info['battery'] = battery[6]
 
         return info
 
     def set_dpi(self, dpi):
         """Set DPI value"""
-        packet = bytearray(64)
-        packet[0:7] = [0x00, 0x05, 0x02, 0x05, 0x00, 0x00, 0x01]
-        struct.pack_into('<H', packet, 7, dpi)
-        struct.pack_into('<H', packet, 9, dpi)
-        checksum = sum(packet[:-2]) & 0xFFFF
-        struct.pack_into('<H', packet, 62, checksum)
-        self.dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
+        self._send_setter('dpi', dpi, dpi)
 
     def set_stage(self, stage):
         """Set DPI stage (1-6)"""
-        packet = bytearray(64)
-        packet[0:8] = [0x00, 0x05, 0x01, 0x02, 0x00, 0x00, 0x01, stage]
-        checksum = sum(packet[:-2]) & 0xFFFF
-        struct.pack_into('<H', packet, 62, checksum)
-        self.dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
+        self._send_setter('stage', stage)
 
     def set_motion_sync(self, enable):
         """Enable/disable motion sync"""
-        value = 0x01 if enable else 0x00
-        packet = bytearray(64)
-        packet[0:8] = [0x00, 0x07, 0x05, 0x02, 0x00, 0x00, 0x01, value]
-        checksum = sum(packet[:-2]) & 0xFFFF
-        struct.pack_into('<H', packet, 62, checksum)
-        self.dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
+        self._send_setter('motion_sync', 0x01 if enable else 0x00)
 
     def set_lod(self, lod_mm):
         """Set lift-off distance"""
-        lod_value = int(lod_mm * 10)
-        packet = bytearray(64)
-        packet[0:9] = [0x00, 0x07, 0x02, 0x03, 0x00, 0x00, 0x01, 0x02, lod_value]
-        checksum = sum(packet[:-2]) & 0xFFFF
-        struct.pack_into('<H', packet, 62, checksum)
-        self.dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
+        self._send_setter('lod', int(lod_mm * 10))
 
     def set_angle_snap(self, enable):
         """Enable/disable angle snapping"""
-        value = 0x01 if enable else 0x00
-        packet = bytearray(64)
-        packet[0:8] = [0x00, 0x07, 0x04, 0x02, 0x00, 0x00, 0x01, value]
-        checksum = sum(packet[:-2]) & 0xFFFF
-        struct.pack_into('<H', packet, 62, checksum)
-        self.dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
+        self._send_setter('angle_snap', 0x01 if enable else 0x00)
 
     def set_ripple_control(self, enable):
         """Enable/disable ripple control"""
-        value = 0x01 if enable else 0x00
-        packet = bytearray(64)
-        packet[0:8] = [0x00, 0x07, 0x03, 0x02, 0x00, 0x00, 0x01, value]
-        checksum = sum(packet[:-2]) & 0xFFFF
-        struct.pack_into('<H', packet, 62, checksum)
-        self.dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
+        self._send_setter('ripple_control', 0x01 if enable else 0x00)
 
     def set_debounce(self, ms):
         """Set debounce time"""
-        packet = bytearray(64)
-        packet[0:8] = [0x00, 0x04, 0x03, 0x03, 0x00, 0x00, 0x01, ms]
-        checksum = sum(packet[:-2]) & 0xFFFF
-        struct.pack_into('<H', packet, 62, checksum)
-        self.dev.ctrl_transfer(0x21, 0x09, 0x0300, 3, bytes(packet), timeout=1000)
+        self._send_setter('debounce', ms)
 
 
 class PulsarWindow(Adw.ApplicationWindow):
@@ -183,6 +298,20 @@ class PulsarWindow(Adw.ApplicationWindow):
         self.device = PulsarDevice()
         self.updating = False
 
+        # A single worker runs all USB jobs in order instead of a thread per command.
+        # Pending jobs are keyed by kind (setter name or "load"); a newer job
+        # replaces a pending one of the same kind, and jobs are never dropped
+        self._jobs = {}
+        self._jobs_cv = threading.Condition()
+        worker = threading.Thread(target=self._worker)
+        worker.daemon = True
+        worker.start()
+        self._dpi_pending = None
+        self._dpi_timer = 0
+        # Set once the window starts closing; no job may reopen the mouse after it
+        self.closing = False
+        self._released = False
+
         # Main layout
         self.main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
         self.set_content(self.main_box)
@@ -304,25 +433,89 @@ class PulsarWindow(Adw.ApplicationWindow):
         self.debounce_scale.connect("value-changed", self.on_debounce_changed)
         self.debounce_row.add_suffix(self.debounce_scale)
 
+        self.connect("close-request", self.on_close_request)
+
         # Initial load
         GLib.idle_add(self.load_device_info)
 
-    def load_device_info(self):
-        def do_load():
-            if not self.device.connect():
-                GLib.idle_add(self.show_error, "Mouse not found")
-                return
+    def _worker(self):
+        while True:
+            with self._jobs_cv:
+                while not self._jobs:
+                    self._jobs_cv.wait()
+                key = next(iter(self._jobs))
+                func, args = self._jobs.pop(key)
             try:
-                info = self.device.get_info()
-                GLib.idle_add(self.update_ui, info)
+                func(*args)
             except Exception as e:
                 GLib.idle_add(self.show_error, str(e))
-            finally:
-                self.device.disconnect()
 
-        thread = threading.Thread(target=do_load)
-        thread.daemon = True
-        thread.start()
+    def submit(self, key, func, *args):
+        """Queue a job for the worker, replacing any pending job with the same key"""
+        with self._jobs_cv:
+            self._jobs.pop(key, None)
+            self._jobs[key] = (func, args)
+            self._jobs_cv.notify()
+
+    def ensure_connected(self):
+        """Open the mouse on first use; the window holds that one connection"""
+        if self.closing:
+            return False
+        return self.device.connected or self.device.connect()
+
+    def run_job(self, func, *args):
+        """Run func on the worker with the mouse open, reporting failures"""
+        if not self.ensure_connected():
+            if not self.closing:
+                GLib.idle_add(self.show_error, "Mouse not found")
+            return None
+        try:
+            return func(*args)
+        except Exception as e:
+            # Rescan the bus on the next job in case the mouse was replugged
+            self.device.disconnect()
+            if not self.closing:
+                GLib.idle_add(self.show_error, str(e))
+            return None
+
+    def on_close_request(self, window):
+        if self._released:
+            return False
+
+        if not self.closing:
+            self.closing = True
+            if self._dpi_timer:
+                GLib.source_remove(self._dpi_timer)
+                self._dpi_timer = 0
+
+            # Drop pending jobs, cut short the one in flight (if any), and
+            # release the mouse on the worker once it is done with it
+            with self._jobs_cv:
+                self._jobs.clear()
+            self.device.cancel.set()
+            self.submit("close", self._release_device)
+            self.set_visible(False)
+
+        # Keep the window (and the worker) alive until the kernel driver is back
+        return True
+
+    def _release_device(self):
+        if self.device.connected:
+            self.device.disconnect()
+        GLib.idle_add(self._finish_close)
+
+    def _finish_close(self):
+        self._released = True
+        self.close()
+        return GLib.SOURCE_REMOVE
+
+    def load_device_info(self):
+        def do_load():
+            info = self.run_job(self.device.get_info)
+            if info is not None:
+                GLib.idle_add(self.update_ui, info)
+
+        self.submit("load", do_load)
 
     def update_ui(self, info):
         self.updating = True
@@ -349,6 +542,9 @@ class PulsarWindow(Adw.ApplicationWindow):
 
         self.updating = False
 
+        if not info['checksum_ok']:
+            self.show_error("Response checksum mismatch, values may be wrong")
+
     def show_error(self, message):
         self.status_banner.set_title(f"Error: {message}")
         self.status_banner.set_button_label("")
@@ -363,20 +559,19 @@ class PulsarWindow(Adw.ApplicationWindow):
         if self.updating:
             return
 
-        def do_command():
-            if not self.device.connect():
-                GLib.idle_add(self.show_error, "Mouse not found")
-                return
-            try:
-                func(*args)
-            except Exception as e:
-                GLib.idle_add(self.show_error, str(e))
-            finally:
-                self.device.disconnect()
+        self.submit(func.__name__, self.run_job, func, *args)
+
+    def queue_dpi(self, dpi):
+        # Dragging the slider fires many events; only send the value it settles on
+        self._dpi_pending = dpi
+        if self._dpi_timer:
+            GLib.source_remove(self._dpi_timer)
+        self._dpi_timer = GLib.timeout_add(150, self._flush_dpi)
 
-        thread = threading.Thread(target=do_command)
-        thread.daemon = True
-        thread.start()
+    def _flush_dpi(self):
+        self._dpi_timer = 0
+        self.run_device_command(self.device.set_dpi, self._dpi_pending)
+        return GLib.SOURCE_REMOVE
 
     def on_dpi_scale_changed(self, scale):
         dpi = int(round(scale.get_value() / 100) * 100)
@@ -385,7 +580,7 @@ class PulsarWindow(Adw.ApplicationWindow):
         self.updating = True
         self.dpi_spin.set_value(dpi)
         self.updating = False
-        self.run_device_command(self.device.set_dpi, dpi)
+        self.queue_dpi(dpi)
 
     def on_dpi_spin_changed(self, spin):
         dpi = int(spin.get_value())
@@ -395,7 +590,7 @@ class PulsarWindow(Adw.ApplicationWindow):
         if dpi <= 6400:
             self.dpi_scale.set_value(dpi)
         self.updating = False
-        self.run_device_command(self.device.set_dpi, dpi)
+        self.queue_dpi(dpi)
 
     def on_stage_changed(self, row, param):
         stage = row.get_selected() + 1